@@ -0,0 +1,875 @@
+"""
+Общий код Review Service и Moderation Service: метрики RPC, трассировка (W3C Trace Context),
+пул соединений PostgreSQL, маршрутизация чтений на реплику, prepared statements, pre-fork запуск
+Конфигурация (переменные окружения) остается в server.py сервиса и передается параметрами.
+В образ копируется рядом с server.py (см. Dockerfile), при локальном запуске импортируется из common/
+"""
+
+import os
+import sys
+import signal
+import multiprocessing
+import threading
+import time
+import weakref
+import contextvars
+from collections import OrderedDict, deque
+
+import grpc
+import psycopg2
+import psycopg2.pool
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               multiprocess, start_http_server)
+import structlog
+
+# Логирование настраивает сервис (structlog.configure); pre-fork процесс заменяет logger
+# на привязанный к номеру процесса
+logger = structlog.get_logger()
+
+# ============================================================================
+# Metrics (Prometheus)
+# ============================================================================
+
+GRPC_SERVER_LATENCY = Histogram(
+    'grpc_server_handling_seconds', 'Время обработки RPC', ['grpc_service', 'grpc_method'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+GRPC_SERVER_HANDLED = Counter(
+    'grpc_server_handled_total', 'Завершенные RPC по коду ответа', ['grpc_service', 'grpc_method', 'grpc_code']
+)
+GRPC_SERVER_IN_FLIGHT = Gauge(
+    'grpc_server_in_flight', 'RPC в обработке', ['grpc_service', 'grpc_method'], multiprocess_mode='livesum'
+)
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    'db_pool_checkout_seconds', 'Время получения соединения из пула', ['pool'],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+DB_POOL_CHECKOUT_ERRORS = Counter('db_pool_checkout_errors_total', 'Ошибки получения соединения из пула', ['pool'])
+DB_POOL_IN_USE = Gauge(
+    'db_pool_connections_in_use', 'Соединения, выданные из пула', ['pool'], multiprocess_mode='livesum'
+)
+DB_POOL_MAX = Gauge('db_pool_connections_max', 'Размер пула соединений', ['pool'], multiprocess_mode='livesum')
+DB_POOL_OPEN = Gauge(
+    'db_pool_connections_open', 'Открытые соединения пула', ['pool'], multiprocess_mode='livesum'
+)
+DB_POOL_WAITERS = Gauge(
+    'db_pool_waiters', 'Запросы, ожидающие соединение из пула', ['pool'], multiprocess_mode='livesum'
+)
+DB_POOL_DISCARDED = Counter(
+    'db_pool_connections_discarded_total', 'Закрытые пулом соединения', ['pool', 'reason']
+)
+DB_READ_ROUTED = Counter(
+    'db_read_routed_total', 'Read-only запросы: replica или причина чтения с primary', ['route']
+)
+DB_REPLICA_HEALTHY = Gauge('db_replica_healthy', 'Реплика используется для чтения (1) / нет (0)', multiprocess_mode='min')
+DB_REPLICA_LAG_SECONDS = Gauge('db_replica_lag_seconds', 'Отставание реплики', multiprocess_mode='max')
+GRPC_CLIENT_LATENCY = Histogram(
+    'grpc_client_handling_seconds', 'Время межсервисных вызовов', ['grpc_method', 'grpc_code'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+GRPC_CLIENT_RETRIES = Counter('grpc_client_retries_total', 'Повторы межсервисных вызовов', ['grpc_method'])
+
+GRPC_CODE_NAMES = {code.value[0]: code.name for code in grpc.StatusCode}
+
+def status_code_name(code):
+    """Имя кода ответа (sync контекст отдает StatusCode, aio - int)"""
+    if code is None:
+        return 'OK'
+    if isinstance(code, grpc.StatusCode):
+        return code.name
+    return GRPC_CODE_NAMES.get(code, str(code))
+
+def _context_code(context):
+    try:
+        return status_code_name(context.code())
+    except Exception:
+        return 'UNKNOWN'
+
+class RpcMetrics:
+    """Учет одного RPC: in-flight, латентность и код ответа"""
+
+    def __init__(self, full_method):
+        _, _, path = full_method.partition('/')
+        self.service, _, self.method = path.partition('/')
+
+    def __enter__(self):
+        GRPC_SERVER_IN_FLIGHT.labels(self.service, self.method).inc()
+        self._started = time.perf_counter()
+        return self
+
+    def finish(self, context, failed=False):
+        code = _context_code(context)
+        if failed and code == 'OK':
+            code = 'UNKNOWN'
+        GRPC_SERVER_LATENCY.labels(self.service, self.method).observe(time.perf_counter() - self._started)
+        GRPC_SERVER_HANDLED.labels(self.service, self.method, code).inc()
+        return code
+
+    def __exit__(self, exc_type, exc, tb):
+        GRPC_SERVER_IN_FLIGHT.labels(self.service, self.method).dec()
+        return False
+
+def _wrap_handler(handler, full_method, aio, tracer):
+    """
+    Обернуть unary-unary / unary-stream обработчик учетом метрик
+    Для unary-unary открывается серверный span tracer'а, родитель - traceparent вызывающей стороны
+    """
+    if handler is None:
+        return None
+
+    if handler.unary_unary:
+        inner = handler.unary_unary
+        if aio:
+            async def behavior(request, context):
+                parent = extract_trace_context(context.invocation_metadata())
+                with RpcMetrics(full_method) as metrics, \
+                        tracer.start_span(metrics.method, parent=parent, kind='server') as span:
+                    try:
+                        response = await inner(request, context)
+                    except BaseException:
+                        metrics.finish(context, failed=True)
+                        raise
+                    code = metrics.finish(context)
+                    if code != 'OK':
+                        span.set_error(code)
+                    return response
+        else:
+            def behavior(request, context):
+                parent = extract_trace_context(context.invocation_metadata())
+                with RpcMetrics(full_method) as metrics, \
+                        tracer.start_span(metrics.method, parent=parent, kind='server') as span:
+                    try:
+                        response = inner(request, context)
+                    except BaseException:
+                        metrics.finish(context, failed=True)
+                        raise
+                    code = metrics.finish(context)
+                    if code != 'OK':
+                        span.set_error(code)
+                    return response
+        return grpc.unary_unary_rpc_method_handler(
+            behavior,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer
+        )
+
+    if handler.unary_stream:
+        inner = handler.unary_stream
+        if aio:
+            async def behavior(request, context):
+                with RpcMetrics(full_method) as metrics:
+                    try:
+                        async for response in inner(request, context):
+                            yield response
+                    except BaseException:
+                        metrics.finish(context, failed=True)
+                        raise
+                    metrics.finish(context)
+        else:
+            def behavior(request, context):
+                with RpcMetrics(full_method) as metrics:
+                    try:
+                        yield from inner(request, context)
+                    except BaseException:
+                        metrics.finish(context, failed=True)
+                        raise
+                    metrics.finish(context)
+        return grpc.unary_stream_rpc_method_handler(
+            behavior,
+            request_deserializer=handler.request_deserializer,
+            response_serializer=handler.response_serializer
+        )
+
+    # stream-stream (reflection) - без метрик
+    return handler
+
+class MetricsInterceptor(grpc.ServerInterceptor):
+    """Метрики RPC для grpc.server"""
+
+    def __init__(self, tracer):
+        self._tracer = tracer
+
+    def intercept_service(self, continuation, handler_call_details):
+        return _wrap_handler(continuation(handler_call_details), handler_call_details.method, False, self._tracer)
+
+class AioMetricsInterceptor(grpc.aio.ServerInterceptor):
+    """Метрики RPC для grpc.aio сервера"""
+
+    def __init__(self, tracer):
+        self._tracer = tracer
+
+    async def intercept_service(self, continuation, handler_call_details):
+        return _wrap_handler(
+            await continuation(handler_call_details), handler_call_details.method, True, self._tracer
+        )
+
+def observe_client_call(method, started, code):
+    """Латентность межсервисного вызова"""
+    GRPC_CLIENT_LATENCY.labels(method, status_code_name(code)).observe(time.perf_counter() - started)
+
+def start_metrics_server(port, worker_index=None):
+    """
+    HTTP endpoint /metrics на port (0 - выключен)
+    В pre-fork режиме (worker_index - номер процесса) с PROMETHEUS_MULTIPROC_DIR метрики
+    всех процессов отдает родитель, без него - только процесс 0 (свои метрики)
+    """
+    if port <= 0:
+        return
+    if worker_index is not None:
+        if os.getenv('PROMETHEUS_MULTIPROC_DIR') or worker_index != 0:
+            return
+    start_http_server(port)
+    logger.info("metrics_server_started", port=port)
+
+def start_multiprocess_metrics_server(port):
+    """Метрики всех pre-fork процессов (родительский процесс, PROMETHEUS_MULTIPROC_DIR)"""
+    if port <= 0 or not os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        return
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(port, registry=registry)
+    logger.info("metrics_server_started", port=port, multiprocess=True)
+
+# ============================================================================
+# Tracing (W3C Trace Context)
+# ============================================================================
+
+TRACEPARENT_HEADER = 'traceparent'
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class SpanContext:
+    """Идентификаторы span'а, передаются между сервисами заголовком traceparent"""
+
+    __slots__ = ('trace_id', 'span_id', 'sampled')
+
+    def __init__(self, trace_id, span_id, sampled=True):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def to_traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    @classmethod
+    def from_traceparent(cls, value):
+        """Разбор заголовка traceparent, None если он некорректен"""
+        parts = value.strip().lower().split('-') if value else []
+        if len(parts) < 4 or parts[0] == 'ff' or len(parts[1]) != 32 or len(parts[2]) != 16:
+            return None
+        try:
+            int(parts[1], 16)
+            int(parts[2], 16)
+            flags = int(parts[3][:2], 16)
+        except ValueError:
+            return None
+        if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+            return None
+        return cls(parts[1], parts[2], bool(flags & 1))
+
+class Span:
+    """
+    Этап обработки запроса (модель span'а OpenTelemetry): имя, родитель,
+    длительность, атрибуты и статус. Используется как context manager
+    """
+
+    def __init__(self, tracer, name, parent, kind, attributes):
+        self._tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.context = SpanContext(
+            parent.trace_id if parent else os.urandom(16).hex(),
+            os.urandom(8).hex(),
+            parent.sampled if parent else True
+        )
+        self.parent_span_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.status = 'OK'
+        self.start_time = None
+        self.duration_ms = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def set_error(self, description):
+        self.status = 'ERROR'
+        self.attributes['error'] = description
+
+    def __enter__(self):
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+        _current_span.reset(self._token)
+        if exc_type is not None and self.status == 'OK':
+            self.set_error(exc_type.__name__)
+        self._tracer.export(self)
+        return False
+
+class NoopSpanExporter:
+    """Span'ы не сохраняются (контекст трассировки все равно передается дальше)"""
+
+    def export(self, span):
+        pass
+
+class LogSpanExporter:
+    """Завершенные span'ы пишутся в лог событием span"""
+
+    def export(self, span):
+        logger.info(
+            "span",
+            trace_id=span.context.trace_id,
+            span_id=span.context.span_id,
+            parent_span_id=span.parent_span_id,
+            span_name=span.name,
+            span_kind=span.kind,
+            duration_ms=round(span.duration_ms, 3),
+            status=span.status,
+            attributes=span.attributes
+        )
+
+class InMemorySpanExporter:
+    """Завершенные span'ы хранятся в памяти (тесты и отладка)"""
+
+    def __init__(self, max_spans=10000):
+        self._lock = threading.Lock()
+        self._spans = deque(maxlen=max_spans)
+
+    def export(self, span):
+        with self._lock:
+            self._spans.append(span)
+
+    def get_finished_spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+SPAN_EXPORTERS = {
+    'none': NoopSpanExporter,
+    'log': LogSpanExporter,
+    'memory': InMemorySpanExporter,
+}
+
+class Tracer:
+    """Создание span'ов; родитель - текущий span потока / asyncio задачи"""
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+
+    def start_span(self, name, parent=None, kind='internal', **attributes):
+        if parent is None:
+            current = _current_span.get()
+            parent = current.context if current else None
+        return Span(self, name, parent, kind, attributes)
+
+    def export(self, span):
+        if not span.context.sampled:
+            return
+        try:
+            self.exporter.export(span)
+        except Exception as e:
+            logger.warning("span_export_failed", span_name=span.name, error=str(e))
+
+def create_tracer(exporter_name):
+    exporter_class = SPAN_EXPORTERS.get(exporter_name)
+    if exporter_class is None:
+        logger.warning("unknown_tracing_exporter", exporter=exporter_name)
+        exporter_class = NoopSpanExporter
+    return Tracer(exporter_class())
+
+def inject_trace_context(metadata=None):
+    """Метаданные исходящего вызова с traceparent текущего span'а"""
+    metadata = list(metadata or ())
+    span = _current_span.get()
+    if span is not None:
+        metadata.append((TRACEPARENT_HEADER, span.context.to_traceparent()))
+    return metadata
+
+def current_trace_id():
+    """trace_id текущего span'а (для связи логов с трассой)"""
+    span = _current_span.get()
+    return span.context.trace_id if span else None
+
+def extract_trace_context(metadata):
+    """SpanContext вызывающей стороны из метаданных входящего вызова"""
+    for key, value in metadata or ():
+        if key == TRACEPARENT_HEADER:
+            return SpanContext.from_traceparent(value)
+    return None
+
+# ============================================================================
+# Database Connection Pool
+# ============================================================================
+
+class PoolBusyError(psycopg2.pool.PoolError):
+    """Нет свободного соединения: очередь ожидания заполнена или истек таймаут ожидания"""
+
+class DatabasePool:
+    """
+    Пул соединений PostgreSQL (замена ThreadedConnectionPool)
+    - при исчерпании getconn ждет свободное соединение до checkout_timeout,
+      ожидающих не больше max_waiters, сверх этого - сразу PoolBusyError
+    - соединение, простоявшее в пуле дольше health_check_idle, проверяется SELECT 1,
+      сломанное (например, после failover PostgreSQL) заменяется новым
+    - соединения старше max_age закрываются и открываются заново
+    - при возврате незавершенная транзакция откатывается
+    on_connect(conn) вызывается для каждого нового соединения, name - метка pool в метриках,
+    connect_timeout - таймаут подключения в секундах (None - без таймаута)
+    """
+
+    def __init__(self, dsn, min_size, max_size, checkout_timeout, max_waiters, max_age, health_check_idle,
+                 on_connect=None, name='primary', connect_timeout=None):
+        self.name = name
+        self._dsn = dsn
+        self._connect_kwargs = {'connect_timeout': connect_timeout} if connect_timeout else {}
+        self._on_connect = on_connect
+        self._max_size = max(1, max_size)
+        self._checkout_timeout = checkout_timeout
+        self._max_waiters = max_waiters
+        self._max_age = max_age
+        self._health_check_idle = health_check_idle
+        self._cond = threading.Condition()
+        self._idle = []          # (conn, created_at, idle_since), последним - самое свежее
+        self._in_use = {}        # id(conn) -> created_at
+        self._size = 0           # открытые соединения (idle + выданные + открываемые)
+        self._waiters = 0
+        self._closed = False
+        self._stats = {'checkouts': 0, 'waits': 0, 'wait_seconds': 0.0, 'busy': 0, 'discarded': 0}
+
+        for _ in range(min(min_size, self._max_size)):
+            self._idle.append((self._connect(), time.monotonic(), time.monotonic()))
+            self._size += 1
+        DB_POOL_OPEN.labels(self.name).set(self._size)
+
+    def _connect(self):
+        conn = psycopg2.connect(self._dsn, **self._connect_kwargs)
+        if self._on_connect:
+            self._on_connect(conn)
+        return conn
+
+    def _reserve(self, deadline):
+        """
+        Занять idle соединение или слот под новое
+        Returns: (conn, created_at, idle_since) или None - слот под новое соединение
+        """
+        with self._cond:
+            waited = False
+            try:
+                while True:
+                    if self._closed:
+                        raise psycopg2.pool.PoolError("connection pool is closed")
+                    if self._idle:
+                        return self._idle.pop()
+                    if self._size < self._max_size:
+                        self._size += 1
+                        return None
+                    if not waited and self._waiters >= self._max_waiters:
+                        self._stats['busy'] += 1
+                        raise PoolBusyError("database connection pool wait queue is full")
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['busy'] += 1
+                        raise PoolBusyError(f"timed out after {self._checkout_timeout}s waiting for a database connection")
+                    if not waited:
+                        waited = True
+                        self._waiters += 1
+                        self._stats['waits'] += 1
+                        DB_POOL_WAITERS.labels(self.name).inc()
+                    self._cond.wait(remaining)
+            finally:
+                if waited:
+                    self._waiters -= 1
+                    DB_POOL_WAITERS.labels(self.name).dec()
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            DB_POOL_OPEN.labels(self.name).set(self._size)
+            self._cond.notify()
+
+    def _discard(self, conn, reason):
+        DB_POOL_DISCARDED.labels(self.name, reason).inc()
+        with self._cond:
+            self._stats['discarded'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, conn, created_at, idle_since):
+        """Проверка idle соединения перед выдачей. Returns: None или причина замены"""
+        now = time.monotonic()
+        if conn.closed:
+            return 'broken'
+        if self._max_age and now - created_at > self._max_age:
+            return 'max_age'
+        if now - idle_since >= self._health_check_idle:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                return 'stale'
+        return None
+
+    def getconn(self):
+        started = time.monotonic()
+        entry = self._reserve(started + self._checkout_timeout)
+        if entry is not None:
+            conn, created_at, idle_since = entry
+            reason = self._is_usable(conn, created_at, idle_since)
+            if reason is not None:
+                # Слот остается занятым - на его место открывается новое соединение
+                self._discard(conn, reason)
+                logger.warning("database_connection_replaced", reason=reason)
+                entry = None
+        if entry is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._release_slot()
+                raise
+            created_at = time.monotonic()
+
+        with self._cond:
+            self._in_use[id(conn)] = created_at
+            self._stats['checkouts'] += 1
+            self._stats['wait_seconds'] += time.monotonic() - started
+            DB_POOL_OPEN.labels(self.name).set(self._size)
+        return conn
+
+    def owns(self, conn):
+        """Соединение выдано этим пулом и еще не возвращено"""
+        with self._cond:
+            return id(conn) in self._in_use
+
+    def putconn(self, conn, close=False):
+        with self._cond:
+            created_at = self._in_use.pop(id(conn), None)
+        if created_at is None:
+            # Соединение выдано не этим пулом (или уже возвращено)
+            conn.close()
+            return
+        reason = None
+        if close or self._closed:
+            reason = 'closed'
+        elif conn.closed:
+            reason = 'broken'
+        elif self._max_age and time.monotonic() - created_at > self._max_age:
+            reason = 'max_age'
+        else:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                reason = 'broken'
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    reason = 'broken'
+
+        if reason is not None:
+            self._discard(conn, reason)
+            self._release_slot()
+            return
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            DB_POOL_OPEN.labels(self.name).set(self._size)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(open=self._size, idle=len(self._idle), in_use=len(self._in_use), waiters=self._waiters)
+        stats['avg_wait_ms'] = round(stats['wait_seconds'] * 1000 / stats['checkouts'], 3) if stats['checkouts'] else 0.0
+        del stats['wait_seconds']
+        return stats
+
+def error_status_code(error):
+    """Код ответа для ошибки обработчика: нет свободного соединения - RESOURCE_EXHAUSTED, иначе INTERNAL"""
+    if isinstance(error, PoolBusyError):
+        return grpc.StatusCode.RESOURCE_EXHAUSTED
+    return grpc.StatusCode.INTERNAL
+
+def checkout_connection(db):
+    """Соединение из пула db с метриками checkout/in-use по метке pool"""
+    started = time.perf_counter()
+    try:
+        conn = db.getconn()
+    except Exception:
+        DB_POOL_CHECKOUT_ERRORS.labels(db.name).inc()
+        raise
+    DB_POOL_CHECKOUT_SECONDS.labels(db.name).observe(time.perf_counter() - started)
+    DB_POOL_IN_USE.labels(db.name).inc()
+    return conn
+
+# ============================================================================
+# Prepared Statements
+# ============================================================================
+
+class PreparedStatements:
+    """
+    Реестр серверных prepared statements горячих запросов
+    PREPARE выполняется один раз, когда пул открывает соединение, дальше запрос
+    идет как EXECUTE без повторного разбора и планирования. Если PREPARE на соединении
+    не удался (или DB_PREPARED_STATEMENTS=false), используется обычный запрос.
+    statements: имя -> SQL с параметрами %s (как для cursor.execute)
+    """
+
+    def __init__(self, statements, enabled=True):
+        self._statements = statements
+        self._enabled = enabled
+        self._prepared = weakref.WeakSet()
+        self._execute_sql = {}
+        for name, query in statements.items():
+            count = query.count('%s')
+            self._execute_sql[name] = f"EXECUTE {name} ({', '.join(['%s'] * count)})" if count else f"EXECUTE {name}"
+
+    @staticmethod
+    def _positional(query):
+        """%s -> $1, $2, ... для PREPARE"""
+        parts = query.split('%s')
+        return parts[0] + ''.join(f'${index}{part}' for index, part in enumerate(parts[1:], 1))
+
+    def prepare(self, conn):
+        """Подготовить все запросы на новом соединении (hook DatabasePool on_connect)"""
+        if not self._enabled:
+            return
+        try:
+            with conn.cursor() as cursor:
+                for name, query in self._statements.items():
+                    cursor.execute(f"PREPARE {name} AS {self._positional(query)}")
+            conn.commit()
+            self._prepared.add(conn)
+        except psycopg2.Error as e:
+            conn.rollback()
+            logger.warning("prepare_statements_failed", error=str(e))
+
+    def execute(self, cursor, name, params):
+        if cursor.connection in self._prepared:
+            cursor.execute(self._execute_sql[name], params)
+        else:
+            cursor.execute(self._statements[name], params)
+
+# ============================================================================
+# Read Replica
+# ============================================================================
+
+# Отставание реплики в секундах (0 - primary или реплика догнала primary)
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+class ReplicaRouter:
+    """
+    Маршрутизация read-only запросов на реплику
+    - read-your-writes: после записи этого процесса по ключу пользователя ('user', user_id)
+      его чтения window секунд идут на primary. Ключи фильмов не отмечаются: запись в популярный
+      фильм уводила бы на primary все его чтения
+    - реплика исключается из чтения, если проверка (раз в check_interval) не прошла
+      или отставание больше max_lag, и возвращается после успешной проверки
+    Окно записей хранится в памяти процесса: запись через другой pod/процесс
+    не учитывается, поэтому клиент должен читать через тот же процесс или допускать отставание
+    """
+
+    def __init__(self, pool, window, max_lag, check_interval, max_keys=100000):
+        self.pool = pool
+        self._window = window
+        self._max_lag = max_lag
+        self._check_interval = check_interval
+        self._max_keys = max_keys
+        self._lock = threading.Lock()
+        self._recent_writes = OrderedDict()  # ключ -> monotonic время окончания окна
+        self._healthy = False
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def record_write(self, *keys):
+        """Отметить запись по ключам: чтения по ним window секунд идут на primary"""
+        if self._window <= 0:
+            return
+        until = time.monotonic() + self._window
+        with self._lock:
+            for key in keys:
+                self._recent_writes[key] = until
+                self._recent_writes.move_to_end(key)
+            while len(self._recent_writes) > self._max_keys:
+                self._recent_writes.popitem(last=False)
+
+    def _recently_written(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            # Окна упорядочены по времени записи - истекшие удаляются с начала
+            while self._recent_writes:
+                key, until = next(iter(self._recent_writes.items()))
+                if until > now:
+                    break
+                self._recent_writes.popitem(last=False)
+            return any(key in self._recent_writes for key in keys)
+
+    def primary_reason(self, keys):
+        """Причина читать с primary или None - можно читать с реплики"""
+        if not self._healthy:
+            return 'replica_unhealthy'
+        if keys and self._recently_written(keys):
+            return 'read_your_writes'
+        return None
+
+    def set_healthy(self, healthy, reason=None):
+        with self._lock:
+            changed = healthy != self._healthy
+            self._healthy = healthy
+        if changed:
+            DB_REPLICA_HEALTHY.set(1 if healthy else 0)
+            if healthy:
+                logger.info("replica_healthy")
+            else:
+                logger.warning("replica_unhealthy", reason=reason)
+
+    def check(self):
+        """Проверка доступности и отставания реплики"""
+        conn = None
+        try:
+            conn = self.pool.getconn()
+            with conn.cursor() as cursor:
+                cursor.execute(REPLICA_LAG_SQL)
+                lag = float(cursor.fetchone()[0])
+            conn.rollback()
+        except PoolBusyError:
+            # Все соединения заняты запросами - реплика отвечает
+            return
+        except Exception as e:
+            self.set_healthy(False, str(e))
+            return
+        finally:
+            if conn:
+                self.pool.putconn(conn)
+
+        DB_REPLICA_LAG_SECONDS.set(lag)
+        if lag > self._max_lag:
+            self.set_healthy(False, f"replication lag {lag:.1f}s exceeds {self._max_lag}s")
+        else:
+            self.set_healthy(True)
+
+    def _run(self):
+        while not self._stop_event.wait(self._check_interval):
+            self.check()
+
+    def start(self):
+        self.check()
+        self._thread = threading.Thread(target=self._run, name="replica-health", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self._check_interval)
+
+# ============================================================================
+# Asyncio Server Mode (grpc.aio)
+# ============================================================================
+
+class ServicerContextAdapter:
+    """
+    Контекст для синхронного кода, выполняемого в executor'е из grpc.aio обработчика
+    Код и детали ошибки запоминаются и применяются к aio контексту в потоке event loop
+    """
+
+    def __init__(self, context):
+        self._context = context
+        self._code = None
+        self._details = None
+
+    def set_code(self, code):
+        self._code = code
+
+    def set_details(self, details):
+        self._details = details
+
+    def is_active(self):
+        return not self._context.done()
+
+    def time_remaining(self):
+        return self._context.time_remaining()
+
+    def invocation_metadata(self):
+        return self._context.invocation_metadata()
+
+    def apply(self):
+        if self._code is not None:
+            self._context.set_code(self._code)
+        if self._details is not None:
+            self._context.set_details(self._details)
+
+# ============================================================================
+# Pre-fork
+# ============================================================================
+
+def serve_prefork(processes, run_worker, process_name, shutdown_timeout, metrics_port, **log_fields):
+    """
+    Pre-fork запуск: N процессов слушают один порт через SO_REUSEPORT
+    Процессы создаются до инициализации gRPC, run_worker(index, processes) - точка входа процесса.
+    SIGTERM/SIGINT пересылается всем процессам, если один процесс завершился сам -
+    останавливаются все (pod перезапустит Kubernetes)
+    """
+    context = multiprocessing.get_context('fork')
+    workers = [
+        context.Process(target=run_worker, args=(index, processes), name=f"{process_name}-{index}")
+        for index in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    start_multiprocess_metrics_server(metrics_port)
+    logger.info("prefork_started", processes=processes, pids=[worker.pid for worker in workers], **log_fields)
+
+    stopping = threading.Event()
+
+    def handle_sigterm(signum, frame):
+        logger.info("received_sigterm", signal=signum)
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    signal.signal(signal.SIGINT, handle_sigterm)
+
+    while not stopping.is_set():
+        if any(not worker.is_alive() for worker in workers):
+            logger.error("prefork_worker_exited",
+                        exitcodes={worker.pid: worker.exitcode for worker in workers if not worker.is_alive()})
+            break
+        stopping.wait(1)
+
+    for worker in workers:
+        if worker.is_alive():
+            os.kill(worker.pid, signal.SIGTERM)
+    # Каждый процесс дожидается завершения RPC (server.stop(grace).wait()) и останавливает
+    # компоненты до выхода; родитель ждет их не дольше shutdown_timeout
+    deadline = time.monotonic() + shutdown_timeout
+    for worker in workers:
+        worker.join(timeout=max(0.0, deadline - time.monotonic()))
+        if worker.is_alive():
+            logger.warning("prefork_worker_killed", pid=worker.pid)
+            worker.kill()
+            worker.join()
+    logger.info("prefork_stopped")
+    sys.exit(0 if stopping.is_set() else 1)
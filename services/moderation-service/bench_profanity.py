@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк проверки на мат: ProfanityMatcher против прежней реализации
+(split + посимвольная очистка + поиск в set) на отзывах по 1000 символов
+
+Запуск (из каталога сервиса, после generate_proto.sh и pip install -r requirements.txt):
+    python bench_profanity.py [--number 2000]
+
+Кроме пропускной способности проверяет регрессию: на тексте из одних '$', '!' и т.п.
+(такой отзыв проходит валидацию) время должно расти линейно, а не взрываться
+из-за перебора с возвратом. Код выхода 1 - регрессия или неверный результат
+"""
+
+import argparse
+import sys
+import time
+import timeit
+
+from server import PROFANITY_WORDS, ProfanityMatcher
+
+# Отзыв максимальной длины (валидация CreateReview - 1000 символов)
+REVIEW_LENGTH = 1000
+
+CLEAN_REVIEW = (
+    "Great movie with a strong cast and a clever plot, the soundtrack fits every scene "
+    "and the pacing never drags. Worth watching twice, especially on a big screen! "
+    * 10
+)[:REVIEW_LENGTH]
+
+PROFANE_REVIEW = (CLEAN_REVIEW[:REVIEW_LENGTH - 40] + " honestly the ending was $h.i.t!!")[:REVIEW_LENGTH]
+
+# (текст, должен ли он совпасть) при словаре по умолчанию
+EXPECTED = [
+    ("this is shit", True),
+    ("sh.i.t", True),
+    ("shiiit", True),
+    ("$hit", True),
+    ("shit!", True),
+    ("(shit)", True),
+    ("f.u.c.k you", True),
+    ("bullshit", False),
+    ("shirt", False),
+    (CLEAN_REVIEW, False),
+    (PROFANE_REVIEW, True),
+]
+
+# Тексты, на которых регулярное выражение с вложенными квантификаторами уходило
+# в перебор: 800 символов '$' - 12.7 с, 1000 - 25 с
+PATHOLOGICAL = ['$', '!', '@', '|', '$.', '1|', 's$', '$h', 'sh!']
+PATHOLOGICAL_LENGTHS = (200, 400, 800, 1000)
+# Предел на один вызов для текста максимальной длины
+PATHOLOGICAL_MAX_SECONDS = 0.05
+
+
+def legacy_contains_profanity(text, words=PROFANITY_WORDS):
+    """Реализация до ProfanityMatcher"""
+    found_profanity = []
+    for word in text.lower().split():
+        clean_word = ''.join(c for c in word if c.isalnum())
+        if clean_word in words:
+            found_profanity.append(clean_word)
+    return len(found_profanity) > 0, found_profanity
+
+
+def ops_per_second(func, text, number):
+    return number / timeit.timeit(lambda: func(text), number=number)
+
+
+def check_results(matcher):
+    failures = 0
+    for text, expected in EXPECTED:
+        if bool(matcher.find_all(text)) != expected:
+            failures += 1
+            print(f"FAIL: {text[:40]!r} expected match={expected}")
+    return failures
+
+
+def check_pathological(matcher):
+    failures = 0
+    for pattern in PATHOLOGICAL:
+        timings = []
+        for length in PATHOLOGICAL_LENGTHS:
+            text = (pattern * length)[:length]
+            started = time.perf_counter()
+            matcher.find_all(text)
+            timings.append(time.perf_counter() - started)
+        print(f"{pattern!r:>8}: " + "  ".join(
+            f"{length}={seconds * 1000:.2f}ms" for length, seconds in zip(PATHOLOGICAL_LENGTHS, timings)
+        ))
+        if timings[-1] > PATHOLOGICAL_MAX_SECONDS:
+            failures += 1
+            print(f"FAIL: {pattern!r} * {PATHOLOGICAL_LENGTHS[-1]} took {timings[-1]:.3f}s")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=2000, help="вызовов на замер")
+    args = parser.parse_args()
+
+    matcher = ProfanityMatcher(PROFANITY_WORDS)
+    print(f"dictionary: {len(matcher.words)} entries, review length: {REVIEW_LENGTH}")
+
+    for name, text in (('clean', CLEAN_REVIEW), ('profane', PROFANE_REVIEW)):
+        legacy = ops_per_second(legacy_contains_profanity, text, args.number)
+        compiled = ops_per_second(matcher.find_all, text, args.number)
+        print(f"{name:>8}: legacy {legacy:,.0f} ops/s, matcher {compiled:,.0f} ops/s")
+
+    print("pathological inputs:")
+    failures = check_pathological(matcher) + check_results(matcher)
+    if failures:
+        print(f"{failures} check(s) failed")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
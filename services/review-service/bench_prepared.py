@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+A/B бенчмарк prepared statements: EXECUTE подготовленного запроса против обычного запроса
+
+Оба варианта выполняют одни и те же горячие запросы из реестра prepared_statements
+(GetReview, ListReviews, подсчет отзывов) на отдельных соединениях к одной БД, чередуя
+раунды A и B, чтобы кэш и фоновая нагрузка делились поровну. Печатает p50/p99 и ops/s
+по каждому запросу и отношение p50 обычного запроса к EXECUTE.
+
+Запуск (из каталога сервиса, после generate_proto.sh и pip install -r requirements.txt;
+в БД должны быть отзывы, например после нагрузочного теста):
+    DATABASE_URL_POSTGRES=postgresql://... python bench_prepared.py [--iterations 5000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import psycopg2
+
+# Реестр создается при импорте server: включаем PREPARE независимо от окружения
+os.environ['DB_PREPARED_STATEMENTS'] = 'true'
+
+from server import DATABASE_URL, prepared_statements
+
+ROUNDS = 5
+WARMUP_ITERATIONS = 200
+PAGE_SIZE = 10
+
+
+def load_sample(conn, movie_id, size):
+    """Фильм с наибольшим числом отзывов (или movie_id) и ключи его отзывов для GetReview"""
+    with conn.cursor() as cursor:
+        if movie_id is None:
+            cursor.execute("SELECT movie_id FROM reviews GROUP BY movie_id ORDER BY COUNT(*) DESC LIMIT 1")
+            row = cursor.fetchone()
+            if row is None:
+                raise SystemExit("reviews table is empty - seed data first")
+            movie_id = row[0]
+        cursor.execute("SELECT user_id, movie_id FROM reviews WHERE movie_id = %s LIMIT %s", (movie_id, size))
+        keys = cursor.fetchall()
+    conn.commit()
+    return movie_id, keys
+
+
+def scenarios(movie_id, keys):
+    """имя запроса -> функция, возвращающая параметры очередного вызова"""
+    return {
+        'get_review': lambda: random.choice(keys),
+        'list_reviews_visible': lambda: (movie_id, PAGE_SIZE, random.randrange(0, 5) * PAGE_SIZE),
+        'count_reviews': lambda: (movie_id,),
+    }
+
+
+def run(conn, name, params, iterations):
+    """Returns: латентности вызовов в секундах"""
+    timings = []
+    with conn.cursor() as cursor:
+        for _ in range(iterations):
+            args = params()
+            started = time.perf_counter()
+            prepared_statements.execute(cursor, name, args)
+            cursor.fetchall()
+            timings.append(time.perf_counter() - started)
+    conn.rollback()
+    return timings
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dsn', default=DATABASE_URL)
+    parser.add_argument('--iterations', type=int, default=5000, help="вызовов каждого запроса на вариант")
+    parser.add_argument('--movie-id', type=int, default=None)
+    args = parser.parse_args()
+
+    plain = psycopg2.connect(args.dsn)
+    prepared = psycopg2.connect(args.dsn)
+    prepared_statements.prepare(prepared)
+    try:
+        movie_id, keys = load_sample(plain, args.movie_id, 1000)
+        if not keys:
+            raise SystemExit(f"movie {movie_id} has no reviews")
+        print(f"movie {movie_id}, {len(keys)} review keys, {args.iterations} calls per query and variant")
+
+        per_round = max(1, args.iterations // ROUNDS)
+        for name, params in scenarios(movie_id, keys).items():
+            results = {'plain': [], 'prepared': []}
+            for conn in (plain, prepared):
+                run(conn, name, params, WARMUP_ITERATIONS)
+            for _ in range(ROUNDS):
+                results['plain'] += run(plain, name, params, per_round)
+                results['prepared'] += run(prepared, name, params, per_round)
+
+            for variant, timings in results.items():
+                print(f"{name:>22} {variant:>8}: p50 {percentile(timings, 0.5) * 1e6:7.0f}us  "
+                      f"p99 {percentile(timings, 0.99) * 1e6:7.0f}us  {len(timings) / sum(timings):8,.0f} ops/s")
+            speedup = percentile(results['plain'], 0.5) / percentile(results['prepared'], 0.5)
+            print(f"{name:>22} p50 plain/prepared: {speedup:.2f}x")
+    finally:
+        plain.close()
+        prepared.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())